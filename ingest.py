@@ -0,0 +1,155 @@
+import math
+import queue
+import struct
+import threading
+from multiprocessing import shared_memory
+
+import serial
+
+# 采集进程使用的代码，只依赖标准库和 pyserial，不导入界面相关的模块
+
+
+class SharedRingBuffer:
+    # 单生产者单消费者的共享内存环形缓冲区，采集进程写入解析好的记录，界面进程直接从共享内存读取，不经过 pickle
+    KIND_LINE = 0  # 普通数据行（应答、调试信息等）
+    KIND_MXX = 1  # 解析成功的 MXX 数据行
+    KIND_ERROR = 2  # 采集进程出错，行内容为错误信息
+
+    HEADER = struct.Struct('<QQ')  # 已写入的记录总数, 槽位数
+    HEADER_SIZE = 64
+    SLOT_HEADER = struct.Struct('<QHB5x')  # 记录序号, 行长度, 记录类型
+    FIELDS = struct.Struct('<21d')  # MXX 各字段的数值，无法转换的字段为 NaN
+    LINE_SIZE = 1024  # 足够容纳任何合法的 MXX 数据行
+    SLOT_SIZE = SLOT_HEADER.size + FIELDS.size + LINE_SIZE
+    INVALID_SEQ = 2 ** 64 - 1  # 槽位正在写入
+
+    def __init__(self, name=None, slots=4096):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER_SIZE + slots * self.SLOT_SIZE)
+            self.HEADER.pack_into(self.shm.buf, 0, 0, slots)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self.slots = self.HEADER.unpack_from(self.shm.buf, 0)[1]
+        self.read_count = 0
+        self.overruns = 0  # 读取过慢被覆盖而丢失的记录数
+
+    def slot_offset(self, seq):
+        return self.HEADER_SIZE + (seq % self.slots) * self.SLOT_SIZE
+
+    def publish(self, kind, line, fields=None):
+        # 只能由采集进程调用
+        buf = self.shm.buf
+        seq = self.HEADER.unpack_from(buf, 0)[0]
+        offset = self.slot_offset(seq)
+        encoded = line.encode('utf-8')
+        if len(encoded) > self.LINE_SIZE:
+            # 超长的行只截断后作为普通数据行显示，不能作为字段不全的 MXX 记录交给界面
+            encoded = encoded[:self.LINE_SIZE]
+            kind = self.KIND_LINE if kind == self.KIND_MXX else kind
+            fields = None
+        # 先把序号标记为无效，写完内容后再写入序号，读方据此判断记录是否完整
+        self.SLOT_HEADER.pack_into(buf, offset, self.INVALID_SEQ, len(encoded), kind)
+        if fields is not None:
+            self.FIELDS.pack_into(buf, offset + self.SLOT_HEADER.size, *fields)
+        line_offset = offset + self.SLOT_HEADER.size + self.FIELDS.size
+        buf[line_offset:line_offset + len(encoded)] = encoded
+        self.SLOT_HEADER.pack_into(buf, offset, seq, len(encoded), kind)
+        self.HEADER.pack_into(buf, 0, seq + 1, self.slots)
+
+    def read(self):
+        # 只能由界面进程调用，返回 [(类型, 行, 字段数值)]
+        buf = self.shm.buf
+        write_count = self.HEADER.unpack_from(buf, 0)[0]
+        if write_count - self.read_count > self.slots:
+            self.overruns += write_count - self.slots - self.read_count
+            self.read_count = write_count - self.slots
+        records = []
+        while self.read_count < write_count:
+            seq = self.read_count
+            self.read_count += 1
+            offset = self.slot_offset(seq)
+            slot_seq, length, kind = self.SLOT_HEADER.unpack_from(buf, offset)
+            if slot_seq != seq:
+                self.overruns += 1
+                continue
+            fields = self.FIELDS.unpack_from(buf, offset + self.SLOT_HEADER.size) if kind == self.KIND_MXX else None
+            line_offset = offset + self.SLOT_HEADER.size + self.FIELDS.size
+            line = str(buf[line_offset:line_offset + length], 'utf-8', errors='replace')
+            # 读取期间槽位被覆盖则丢弃
+            if self.SLOT_HEADER.unpack_from(buf, offset)[0] != seq:
+                self.overruns += 1
+                continue
+            records.append((kind, line, fields))
+        return records
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def decode_mxx(line):
+    # 解析 MXX 数据行，返回各字段的数值；格式不对或关键字段无法转换时返回 None
+    data = line.split(',')
+    if len(data) != 21:
+        return None
+    fields = []
+    for value in data:
+        try:
+            fields.append(float(value))
+        except ValueError:
+            fields.append(math.nan)
+    time_str = data[2]
+    if not (len(time_str) >= 6 and time_str[:6].isdigit()):
+        return None
+    # 经纬度、高度、排气时间、抛物量
+    if any(math.isnan(fields[index]) for index in (7, 8, 10, 18, 19)):
+        return None
+    return fields
+
+
+def ingest_process_main(shm_name, port, baudrate, outbound, stop_event, log_path):
+    # 采集进程：独占串口，读取并解析数据，通过共享内存交给界面进程；界面进程的耗时操作不会拖慢串口读取
+    ring = SharedRingBuffer(shm_name)
+    try:
+        serial_port = serial.Serial(port, baudrate, timeout=0.2)
+    except serial.SerialException as e:
+        ring.publish(SharedRingBuffer.KIND_ERROR, f"无法打开串口: {e}")
+        ring.close()
+        return
+
+    def write_outbound():
+        # 上行指令由界面进程放入队列，在这里写入串口
+        while not stop_event.is_set():
+            try:
+                data = outbound.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                serial_port.write(data)
+            except serial.SerialException as e:
+                print(f"写串口失败: {e}")
+
+    threading.Thread(target=write_outbound, daemon=True).start()
+    try:
+        with open(log_path, "a", encoding='utf-8', buffering=1) as file:
+            while not stop_event.is_set():
+                raw = serial_port.readline()
+                if not raw:
+                    continue
+                line = raw.decode('utf-8', errors='replace').strip()
+                file.write(line + '\n')
+                if line.startswith('MXX'):
+                    fields = decode_mxx(line)
+                    if fields is not None:
+                        ring.publish(SharedRingBuffer.KIND_MXX, line, fields)
+                else:
+                    ring.publish(SharedRingBuffer.KIND_LINE, line)
+    except serial.SerialException as e:
+        ring.publish(SharedRingBuffer.KIND_ERROR, f"串口读取失败: {e}")
+    finally:
+        serial_port.close()
+        ring.close()
@@ -1,15 +1,25 @@
+import bisect
+import heapq
+import json
+import multiprocessing
+import os
 import sys
 import time
+from collections import deque
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import serial
 import serial.tools.list_ports
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QVBoxLayout,
-                             QHBoxLayout, QWidget, QLabel, QComboBox, QTextEdit, QGridLayout)
+                             QHBoxLayout, QWidget, QLabel, QComboBox, QTextEdit, QGridLayout, QCheckBox,
+                             QMessageBox)
 from PyQt5.QtCore import QTimer, QTime
 import matplotlib.pyplot as plt
 from folium import Map
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT
+from matplotlib.ticker import FuncFormatter
 from PyQt5.QtWebEngineWidgets import QWebEngineView
 import io
 import folium
@@ -22,9 +32,817 @@ from requests.exceptions import RequestException, ConnectionError, Timeout, HTTP
 from threading import Lock
 from PyQt5.QtGui import QFont
 
+from ingest import SharedRingBuffer, decode_mxx, ingest_process_main
+
 class DataProcessor(QObject):
     dataUpdated = pyqtSignal(list)
     saveexcel = pyqtSignal(list)
+    commandStatus = pyqtSignal(str)  # 上行指令状态（发送/应答/重发/失败）
+    commandLatency = pyqtSignal(float, float)  # 最近一次往返时延、平均往返时延（毫秒）
+    metricsUpdated = pyqtSignal(dict)  # 衍生指标
+    alertRaised = pyqtSignal(str)  # 告警内容
+
+
+# 上行应答协议尚未与下位机确认，以下为假设：
+# 开启 UPLINK_TAG_IDS 后，每条指令按 "内容,#编号" 发送，下位机收到后回传 "ACK,编号"。
+# 只有能按编号匹配的应答才计入时延，也只有开启编号后才允许超时重发；
+# 未开启时指令按原格式发送，超时只提示未确认，不重发。
+UPLINK_TAG_IDS = False
+UPLINK_MAX_RETRIES = 0
+
+
+class CommandUplink:
+    # 指令优先级，数值越小越先发送，切断等紧急指令插队到常规指令之前
+    PRIORITY_URGENT = 0
+    PRIORITY_NORMAL = 1
+
+    def __init__(self, write, signals=None, min_interval=0.5, ack_timeout=3.0, max_retries=0,
+                 ack_prefix='ACK', tag_ids=False):
+        self.write = write  # 写串口的函数，只在发送线程中调用
+        self.signals = signals
+        self.min_interval = min_interval  # 两次写串口之间的最小间隔（秒），防止下位机缓冲区溢出
+        self.ack_timeout = ack_timeout  # 等待应答的超时时间（秒）
+        self.tag_ids = tag_ids  # 是否在指令中附带编号，应答须回传该编号
+        # 无法按编号匹配应答时重发可能导致重复执行，因此未开启编号时不重发
+        self.max_retries = max_retries if tag_ids else 0
+        self.ack_prefix = ack_prefix  # 下位机应答行的前缀，例如 "ACK,12"
+
+        self.queue = []  # 待发送指令堆：(优先级, 序号, 指令)
+        self.pending = {}  # 已发送、等待应答的指令：序号 -> 指令
+        self.latencies = deque(maxlen=100)  # 最近的往返时延（秒）
+        self.seq = 0
+        self.last_write = 0.0
+        self.running = False
+        self.cond = threading.Condition()
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+    def submit(self, payload, priority=PRIORITY_NORMAL):
+        with self.cond:
+            self.seq += 1
+            command = {'seq': self.seq, 'payload': payload, 'priority': priority,
+                       'attempts': 0, 'first_sent_at': 0.0, 'deadline': 0.0}
+            heapq.heappush(self.queue, (priority, command['seq'], command))
+            self.cond.notify_all()
+        self.notify(f"指令#{command['seq']}已排队: {payload}")
+        return command['seq']
+
+    def handle_line(self, line):
+        # 在下行数据中匹配应答，返回 True 表示该行是应答行
+        if not line.startswith(self.ack_prefix):
+            return False
+        ack_body = line[len(self.ack_prefix):].lstrip(',: ').strip()
+        now = time.monotonic()
+        # 只按回传的编号匹配，无编号或编号未知的应答不计入任何指令
+        try:
+            seq = int(ack_body.split(',')[0].lstrip('#'))
+        except ValueError:
+            print(f"无法匹配的应答: {line}")
+            return True
+        with self.cond:
+            matched = self.pending.pop(seq, None)
+            if matched is None:
+                print(f"无法匹配的应答: {line}")
+                return True
+            # 应答无法区分是哪一次发送的，按首次发送计时，重发时偏大而不会偏小
+            latency = now - matched['first_sent_at']
+            self.latencies.append(latency)
+            mean_latency = sum(self.latencies) / len(self.latencies)
+            self.cond.notify_all()
+        self.notify(f"指令#{matched['seq']}已应答: {matched['payload']}")
+        if self.signals is not None:
+            self.signals.commandLatency.emit(latency * 1000, mean_latency * 1000)
+        print(f"指令#{matched['seq']}往返时延: {latency * 1000:.0f} ms")
+        return True
+
+    def snapshot(self):
+        # 返回尚未完成的指令：(从未发送过的, 已发送但未确认的)，各自按发送顺序排列
+        # 已发送的指令下位机可能已经执行，不能自动重发
+        with self.cond:
+            commands = [item[2] for item in self.queue] + list(self.pending.values())
+        commands.sort(key=lambda c: (c['priority'], c['seq']))
+        return ([c for c in commands if c['attempts'] == 0],
+                [c for c in commands if c['attempts'] > 0])
+
+    def notify(self, message):
+        print(message)
+        if self.signals is not None:
+            self.signals.commandStatus.emit(message)
+
+    def check_timeouts(self, now):
+        # 调用方需持有 self.cond
+        for seq, command in list(self.pending.items()):
+            if now < command['deadline']:
+                continue
+            del self.pending[seq]
+            if not self.tag_ids:
+                self.notify(f"指令#{seq}未确认（未启用指令编号，无法匹配应答）: {command['payload']}")
+            elif command['attempts'] > self.max_retries:
+                self.notify(f"指令#{seq}无应答，已放弃: {command['payload']}")
+            else:
+                # 保留原序号重新入队，使其排在同优先级的新指令之前
+                heapq.heappush(self.queue, (command['priority'], seq, command))
+                self.notify(f"指令#{seq}应答超时，准备第{command['attempts']}次重发")
+
+    def run(self):
+        while True:
+            with self.cond:
+                command = None
+                while self.running:
+                    now = time.monotonic()
+                    self.check_timeouts(now)
+                    deadlines = [c['deadline'] for c in self.pending.values()]
+                    if self.queue:
+                        wait = self.last_write + self.min_interval - now
+                        if wait <= 0:
+                            command = heapq.heappop(self.queue)[2]
+                            break
+                        deadlines.append(now + wait)
+                    timeout = min(deadlines) - now if deadlines else None
+                    self.cond.wait(timeout)
+                if command is None:
+                    return
+                command['attempts'] += 1
+                if command['attempts'] == 1:
+                    command['first_sent_at'] = now
+                command['deadline'] = now + self.ack_timeout
+                self.last_write = now
+                self.pending[command['seq']] = command
+
+            payload = command['payload']
+            if self.tag_ids:
+                payload = f"{payload},#{command['seq']}"
+            data_to_send = f"{payload}\r\n"  # 需要回车换行
+            # 先通知界面记录该指令已发送，会话恢复时不再自动重发
+            self.notify(f"指令#{command['seq']}已发送（第{command['attempts']}次）: {command['payload']}")
+            try:
+                self.write(data_to_send.encode())
+            except Exception as e:  # 串口被关闭等情况，按超时处理
+                print(f"指令#{command['seq']}发送失败: {e}")
+
+
+class Ewma:
+    # 指数加权平均，每个样本 O(1)
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, t, x):
+        if self.value is None:
+            self.value = x
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
+
+
+class WindowExtreme:
+    # 时间窗口内的最小/最大值，用单调队列实现，每个样本摊还 O(1)
+    def __init__(self, window, mode='max'):
+        self.window = window  # 窗口长度（秒）
+        self.is_max = mode == 'max'
+        self.queue = deque()  # (时间, 值)，值单调
+        self.value = None
+
+    def update(self, t, x):
+        queue = self.queue
+        while queue and (queue[-1][1] <= x if self.is_max else queue[-1][1] >= x):
+            queue.pop()
+        queue.append((t, x))
+        while queue[0][0] <= t - self.window:
+            queue.popleft()
+        self.value = queue[0][1]
+        return self.value
+
+
+class Rate:
+    # 变化率，对相邻样本的差分做指数平滑，scale 用于换算单位（如每秒换算为每分钟）
+    def __init__(self, alpha, scale=1.0):
+        self.ewma = Ewma(alpha)
+        self.scale = scale
+        self.last = None
+        self.value = None
+
+    def update(self, t, x):
+        if self.last is not None and t > self.last[0]:
+            rate = (x - self.last[1]) / (t - self.last[0]) * self.scale
+            self.value = self.ewma.update(t, rate)
+        self.last = (t, x)
+        return self.value
+
+
+class TelemetryField:
+    # 遥测字段：在 MXX 数据中的位置、界面显示名称、单位、状态含义和数值类型；
+    # 界面、后端上传、局域网广播和导出都从这里取值和格式化
+    def __init__(self, key, index, label=None, unit='', bit=None, states=None, upload=True, numeric=True):
+        self.key = key  # 字段名，也用作上传后端和广播的 JSON 键
+        self.index = index  # 在 MXX 数据中的下标
+        self.label = label  # 界面显示名称，为 None 时不显示
+        self.unit = unit
+        self.bit = bit  # 状态位在状态字符串中的位置
+        self.states = states or {}  # 状态位取值的含义
+        self.upload = upload  # 是否上传后端
+        self.numeric = numeric  # 是否为数值字段，导出时按数值写入
+
+    def raw(self, data):
+        value = data[self.index]
+        if self.bit is not None:
+            return value[self.bit] if len(value) > self.bit else ''
+        return value
+
+    def value(self, data):
+        # 带类型的取值：数值字段转为 float，无法转换时保留原始字符串
+        raw = self.raw(data)
+        if self.numeric and self.bit is None:
+            try:
+                return float(raw)
+            except ValueError:
+                return raw
+        return raw
+
+    def header(self, name):
+        # 导出的列名带上单位
+        return f'{name}({self.unit})' if self.unit else name
+
+    def format(self, value):
+        value = self.states.get(value, value)
+        return f'{value} {self.unit}' if self.unit else value
+
+    def label_text(self, value):
+        return f'{self.label}: {self.format(value)}'
+
+
+# MXX 状态位，data[3] 中每个字符表示一种状态
+STATUS_FIELDS = [
+    TelemetryField('rcTaskStatus', 3, 'RC任务状态', bit=0, states={'0': '待命'}, upload=False),
+    TelemetryField('cutterStatus', 3, '切断器状态', bit=1, states={'0': '未激活', '1': '已激活'}, upload=False),
+    TelemetryField('batteryVoltageStatus', 3, '电池电压状态', bit=2, states={'0': '正常', '1': '异常'}, upload=False),
+    TelemetryField('timeoutStatus', 3, '超时状态', bit=3, states={'0': '未超时', '1': '超时'}, upload=False),
+    TelemetryField('ultraHighStatus', 3, '超高状态', bit=4, states={'0': '正常', '1': '超高'}, upload=False),
+    TelemetryField('ultraFenceStatus', 3, '超围栏状态', bit=5, states={'0': '正常', '1': '超围栏'}, upload=False),
+    TelemetryField('activeCuttingStatus', 3, '主动切断状态', bit=6, states={'0': '未切断', '1': '已切断'}, upload=False),
+]
+
+# MXX 飞行参数，按界面显示顺序排列
+FLIGHT_FIELDS = [
+    TelemetryField('groundSpeed', 4, '水平速度', 'm/s'),
+    TelemetryField('climbSpeed', 5, '上升速度', 'm/s'),
+    TelemetryField('acceleratedSpeed', 6, 'z加速度', 'm/s^2'),
+    TelemetryField('longitude', 7, '经度'),
+    TelemetryField('latitude', 8, '纬度'),
+    TelemetryField('fusionAltitude', 9, '融合高度', '米'),
+    TelemetryField('pressureAltitude', 10, '气压高度', '米'),
+    TelemetryField('gpsAltitude', 11, 'GPS高度', '米'),
+    TelemetryField('gps2Altitude', 12, 'GPS2高度', '米', upload=False),
+    TelemetryField('targetAltitude', 13, '目标平飘高度', '米'),
+    TelemetryField('pt100Temperature', 14, 'PT100温度', '度'),
+    TelemetryField('pcbTemperature', 15, '板上温度', '度'),
+    TelemetryField('batteryVoltage', 16, '电池电压', 'V'),
+    TelemetryField('capacitorVoltage', 17, '电容电压', 'V'),
+    TelemetryField('ventingTime', 18, '排气时间', '秒'),
+    TelemetryField('ballastDropping', 19, '抛物量', '个'),
+    TelemetryField('message', 20, '北斗上发消息量', upload=False),
+]
+
+TELEMETRY_FIELDS = ([TelemetryField('time', 2, '时间', numeric=False),
+                     TelemetryField('status', 3, upload=False, numeric=False)]
+                    + STATUS_FIELDS + FLIGHT_FIELDS)
+TELEMETRY_BY_KEY = {field.key: field for field in TELEMETRY_FIELDS}
+
+# 导出 Excel 的列：(列名, 字段)，前 18 列与原有表格的顺序一致（Altitude 为气压高度），新增的列排在后面
+EXPORT_COLUMNS = [
+    ('Time', 'time'), ('Latitude', 'latitude'), ('Longitude', 'longitude'), ('Altitude', 'pressureAltitude'),
+    ('Ground Speed', 'groundSpeed'), ('Climb Speed', 'climbSpeed'), ('Accelerated Speed', 'acceleratedSpeed'),
+    ('Fusion Altitude', 'fusionAltitude'), ('Pressure Altitude', 'pressureAltitude'),
+    ('GPS Altitude', 'gpsAltitude'), ('Target Altitude', 'targetAltitude'),
+    ('PT100 Temperature', 'pt100Temperature'), ('PCB Temperature', 'pcbTemperature'),
+    ('Battery Voltage', 'batteryVoltage'), ('Capacitor Voltage', 'capacitorVoltage'),
+    ('Venting Time', 'ventingTime'), ('Ballast Dropping', 'ballastDropping'), ('message', 'message'),
+    ('GPS2 Altitude', 'gps2Altitude'), ('Status', 'status'),
+]
+
+
+def field_value(data, key):
+    return TELEMETRY_BY_KEY[key].raw(data)
+
+
+class TelemetryModel:
+    # 遥测数据模型：每个字段与上一次的值比较，只记录变化的字段，
+    # 由界面定时器每帧统一刷新一次，Qt 会把同一帧内的重绘请求合并
+    def __init__(self, fields):
+        self.fields = [field for field in fields if field.label]
+        self.labels = {}  # 字段名 -> QLabel
+        self.values = {}  # 字段名 -> 当前显示的值
+        self.dirty = {}  # 字段名 -> 待显示的值
+
+    def bind(self, key, label):
+        self.labels[key] = label
+
+    def update(self, data):
+        for field in self.fields:
+            if field.key not in self.labels:
+                continue
+            value = field.raw(data)
+            if self.values.get(field.key) != value:
+                self.values[field.key] = value
+                self.dirty[field.key] = value
+
+    def flush(self):
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, {}
+        for key, value in dirty.items():
+            self.labels[key].setText(TELEMETRY_BY_KEY[key].label_text(value))
+
+    def reset(self):
+        self.values = {}
+        self.dirty = {}
+        for field in self.fields:
+            if field.key in self.labels:
+                self.labels[field.key].setText(f'{field.label}: --')
+
+
+def time_to_target(data, values):
+    # 按平滑上升速度估算到达目标平飘高度的时间，正在远离目标或速度过小时返回 None
+    climb_rate = values.get('climb_rate')
+    if climb_rate is None or abs(climb_rate) < 0.05:
+        return None
+    remaining = (float(field_value(data, 'targetAltitude')) - float(field_value(data, 'fusionAltitude'))) / climb_rate
+    return remaining if remaining >= 0 else None
+
+
+# 衍生指标声明：(键, 显示名称, 单位, 取值函数(data, 已算出的指标), 聚合器工厂)
+# 按顺序计算，后面的指标可以引用前面的结果；聚合器工厂为 None 时直接使用取值结果
+DERIVED_METRICS = [
+    ('climb_rate', '平滑上升速度', 'm/s', lambda d, m: float(field_value(d, 'climbSpeed')), lambda: Ewma(0.2)),
+    ('altitude_min', '10分钟最低高度', '米', lambda d, m: float(field_value(d, 'fusionAltitude')),
+     lambda: WindowExtreme(600, 'min')),
+    ('altitude_max', '10分钟最高高度', '米', lambda d, m: float(field_value(d, 'fusionAltitude')),
+     lambda: WindowExtreme(600, 'max')),
+    ('venting_rate', '排气速率', '秒/分', lambda d, m: float(field_value(d, 'ventingTime')), lambda: Rate(0.2, 60)),
+    ('ballast_rate', '抛物速率', '个/分', lambda d, m: float(field_value(d, 'ballastDropping')), lambda: Rate(0.2, 60)),
+    ('time_to_target', '预计到达目标高度', '秒', time_to_target, None),
+]
+
+# 告警规则：(键, 告警内容, 判定函数(data, 衍生指标))，条件由不满足变为满足时触发一次
+ALERT_RULES = [
+    ('cutter', '切断器已激活', lambda d, m: field_value(d, 'cutterStatus') == '1'),
+    ('battery_voltage', '电池电压异常', lambda d, m: field_value(d, 'batteryVoltageStatus') == '1'),
+    ('timeout', '超时', lambda d, m: field_value(d, 'timeoutStatus') == '1'),
+    ('ultra_high', '超高', lambda d, m: field_value(d, 'ultraHighStatus') == '1'),
+    ('ultra_fence', '超出围栏', lambda d, m: field_value(d, 'ultraFenceStatus') == '1'),
+    ('active_cutting', '主动切断', lambda d, m: field_value(d, 'activeCuttingStatus') == '1'),
+    ('fast_descent', '下降速度过快', lambda d, m: m['climb_rate'] is not None and m['climb_rate'] < -8),
+]
+
+
+class MetricsEngine:
+    # 在遥测流上增量计算衍生指标和告警，每个样本的开销与历史长度无关
+    def __init__(self, metrics=DERIVED_METRICS, alerts=ALERT_RULES):
+        self.metrics = metrics
+        self.alerts = alerts
+        self.reset()
+
+    def reset(self):
+        self.aggregators = {key: factory() if factory else None for key, _, _, _, factory in self.metrics}
+        self.values = {key: None for key, _, _, _, _ in self.metrics}
+        self.active_alerts = set()
+        self.last_time = None  # 最近一个样本的时间，跨零点后仍单调递增
+        self.day_offset = 0
+
+    def flight_time(self, time_in_seconds):
+        # 下位机时间只有时分秒，回退超过半天视为跨过零点，补上一天
+        if self.last_time is not None and time_in_seconds + self.day_offset < self.last_time - 43200:
+            return time_in_seconds + self.day_offset + 86400
+        return time_in_seconds + self.day_offset
+
+    def update(self, data, time_in_seconds):
+        t = self.flight_time(time_in_seconds)
+        self.day_offset = t - time_in_seconds
+        self.last_time = t
+
+        values = {}
+        for key, _, _, source, _ in self.metrics:
+            aggregator = self.aggregators[key]
+            try:
+                x = source(data, values)
+            except (ValueError, IndexError, ZeroDivisionError):
+                x = None
+            if aggregator is not None:
+                x = aggregator.update(t, x) if x is not None else aggregator.value
+            values[key] = x
+        self.values = values
+
+        fired = []
+        for key, message, check in self.alerts:
+            try:
+                active = bool(check(data, values))
+            except (ValueError, IndexError):
+                active = False
+            if active and key not in self.active_alerts:
+                self.active_alerts.add(key)
+                fired.append(message)
+            elif not active:
+                self.active_alerts.discard(key)
+        return values, fired
+
+
+def clock_seconds(time_str):
+    # 下位机时间字符串 HHMMSS 转换为当天的秒数
+    return int(time_str[0:2]) * 3600 + int(time_str[2:4]) * 60 + int(time_str[4:6])
+
+
+def format_metric(value, unit):
+    return '--' if value is None else f'{value:.2f} {unit}'
+
+
+def format_clock(t, pos=None):
+    # 秒数格式化为 HH:MM:SS，跨零点后的时间取模显示
+    t = int(t) % 86400
+    return f'{t // 3600:02}:{(t % 3600) // 60:02}:{t % 60:02}'
+
+
+class MinMaxPyramid:
+    # 预先计算的多级最小/最大值桶，按屏幕像素宽度对整段飞行数据降采样，保留极值
+    FACTOR = 4  # 每一级的桶比上一级大 FACTOR 倍
+
+    def __init__(self):
+        self.x = []  # 时间，单调递增
+        self.y = []
+        self.levels = []  # 第 k 级每个桶覆盖 FACTOR**(k+1) 个样本：[最小值, 最小值下标, 最大值, 最大值下标]
+        self.lock = Lock()
+
+    def append(self, x, y):
+        with self.lock:
+            i = len(self.y)
+            self.x.append(x)
+            self.y.append(y)
+            size = self.FACTOR
+            for level in self.levels:
+                j = i // size
+                if j == len(level):
+                    level.append([y, i, y, i])
+                else:
+                    bucket = level[j]
+                    if y < bucket[0]:
+                        bucket[0], bucket[1] = y, i
+                    if y > bucket[2]:
+                        bucket[2], bucket[3] = y, i
+                size *= self.FACTOR
+            # 最粗一级也超过一个桶时，新建更粗的一级，只需从上一级合并一次
+            if i + 1 > size // self.FACTOR:
+                self.levels.append(self.build_level(i + 1, size))
+
+    def extend(self, xs, ys):
+        # 批量载入历史数据（会话恢复时使用），逐级一次性建立
+        with self.lock:
+            self.x.extend(xs)
+            self.y.extend(ys)
+            n = len(self.y)
+            self.levels = []
+            size = self.FACTOR
+            while n > size // self.FACTOR:
+                self.levels.append(self.build_level(n, size))
+                size *= self.FACTOR
+
+    def build_level(self, n, size):
+        # 调用方需持有 self.lock
+        level = []
+        for start in range(0, n, size):
+            chunk = self.y[start:start + size]
+            vmin, vmax = min(chunk), max(chunk)
+            level.append([vmin, start + chunk.index(vmin), vmax, start + chunk.index(vmax)])
+        return level
+
+    def query(self, x0, x1, max_points):
+        # 返回 [x0, x1] 范围内不超过约 max_points 个点，每个桶输出最小值和最大值两个点
+        with self.lock:
+            n = len(self.y)
+            i0 = max(bisect.bisect_left(self.x, x0, 0, n) - 1, 0)  # 两端各多取一个点，使曲线延伸到边界
+            i1 = min(bisect.bisect_right(self.x, x1, 0, n) + 1, n)
+            if i1 - i0 <= max_points or not self.levels:
+                return self.x[i0:i1], self.y[i0:i1]
+            # 选择桶数不超过 max_points / 2 的最细一级
+            size = self.FACTOR
+            for level in self.levels:
+                if (i1 - i0) / size <= max_points / 2:
+                    break
+                size *= self.FACTOR
+            else:
+                size //= self.FACTOR
+            xs, ys = [], []
+            for vmin, imin, vmax, imax in level[i0 // size:(i1 - 1) // size + 1]:
+                for idx in ((imin, imax) if imin < imax else (imax, imin) if imax < imin else (imin,)):
+                    xs.append(self.x[idx])
+                    ys.append(self.y[idx])
+            return xs, ys
+
+
+def mxx_record(data, metrics=None):
+    # 推送给局域网客户端的记录
+    record = {field.key: field.raw(data) for field in TELEMETRY_FIELDS}
+    if metrics is not None:
+        record['derivedMetrics'] = metrics
+    return record
+
+
+BROADCAST_PAGE = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>浮空器实时数据</title></head>
+<body><h3>浮空器实时数据</h3><table id="t"></table>
+<script>
+new EventSource('/events').onmessage = function (e) {
+  var r = JSON.parse(e.data), t = document.getElementById('t');
+  t.replaceChildren();
+  for (var k in r) {
+    var tr = t.insertRow(), name = tr.insertCell(), value = tr.insertCell();
+    name.textContent = k;  // 字段内容来自下位机，只作为文本显示
+    value.textContent = JSON.stringify(r[k]);
+  }
+};
+</script></body></html>
+'''
+
+
+class BroadcastClient:
+    # 每个客户端独立的发送缓冲区，缓冲区满时丢弃最旧的数据，慢客户端只会收到最新数据
+    def __init__(self, buffer_size):
+        self.buffer = deque(maxlen=buffer_size)
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, message):
+        with self.cond:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(message)
+            self.cond.notify()
+
+    def get(self, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: self.buffer or self.closed, timeout)
+            messages = list(self.buffer)
+            self.buffer.clear()
+            return messages
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+
+class BroadcastHandler(BaseHTTPRequestHandler):
+    # 套接字超时（秒），大于 15 秒的心跳间隔；客户端停止读取时写操作超时退出，释放线程
+    timeout = 30
+
+    def do_GET(self):
+        broadcaster = self.server.broadcaster
+        path = self.path.split('?')[0]
+        if path == '/events':
+            self.stream_events(broadcaster)
+        elif path == '/latest':
+            self.send_body(broadcaster.latest or '{}', 'application/json; charset=utf-8')
+        elif path == '/':
+            self.send_body(BROADCAST_PAGE, 'text/html; charset=utf-8')
+        else:
+            self.send_error(404)
+
+    def send_body(self, text, content_type):
+        body = text.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_events(self, broadcaster):
+        # Server-Sent Events：每个客户端一个线程，阻塞在自己的套接字上，不影响串口数据接收
+        client = broadcaster.add_client()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            if broadcaster.latest:
+                self.wfile.write(f'data: {broadcaster.latest}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+            while not client.closed:
+                messages = client.get(15)
+                if not messages:
+                    self.wfile.write(b': keepalive\n\n')  # 心跳，及时发现已断开的客户端
+                for message in messages:
+                    self.wfile.write(f'data: {message}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError, TimeoutError):
+            pass
+        finally:
+            broadcaster.remove_client(client)
+
+    def log_message(self, format, *args):
+        pass  # 不在控制台打印每个请求
+
+
+class TelemetryBroadcaster:
+    # 局域网实时数据推送服务，浏览器访问 http://本机IP:端口/ 即可查看
+    def __init__(self, port=8765, host='0.0.0.0', buffer_size=4):
+        self.host = host
+        self.port = port
+        self.buffer_size = buffer_size  # 每个客户端最多缓存的消息数
+        self.clients = set()
+        self.lock = Lock()
+        self.latest = None  # 最新一条消息，新客户端连接后立即发送
+        self.httpd = None
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.host, self.port), BroadcastHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.broadcaster = self
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        print(f"实时数据广播已启动: http://{self.host}:{self.port}/")
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.close()
+        print("实时数据广播已停止")
+
+    def add_client(self):
+        client = BroadcastClient(self.buffer_size)
+        with self.lock:
+            self.clients.add(client)
+        print(f"广播客户端已连接，当前 {len(self.clients)} 个")
+        return client
+
+    def remove_client(self, client):
+        with self.lock:
+            self.clients.discard(client)
+        print(f"广播客户端已断开，丢弃 {client.dropped} 条过期数据，当前 {len(self.clients)} 个")
+
+    def publish(self, record):
+        # 只序列化一次，放入各客户端缓冲区后立即返回，不等待任何网络发送
+        message = json.dumps(record, ensure_ascii=False)
+        self.latest = message
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.put(message)
+
+
+class SessionJournal:
+    # 会话预写日志：解码后的数据行和会话状态逐条追加到分段日志，定期写入检查点，
+    # 程序或电脑崩溃后从最近的检查点加上其后的日志恢复。
+    # 检查点是增量的：每次只把上次检查点之后的样本作为一块追加到样本文件，
+    # 检查点文件本身只记录会话状态和样本文件的有效长度
+    def __init__(self, directory='session_journal', fsync_interval=1.0):
+        self.directory = directory
+        self.fsync_interval = fsync_interval  # 两次 fsync 之间的最小间隔（秒）
+        os.makedirs(directory, exist_ok=True)
+        paths = [self.checkpoint_path, self.samples_path] + [self.segment_path(segment) for segment in self.segments()]
+        mtimes = [os.path.getmtime(path) for path in paths if os.path.exists(path)]
+        self.last_modified = max(mtimes) if mtimes else None  # 上次会话最后一次写入的时间
+        segments = self.segments()
+        self.segment = segments[-1] if segments else 0
+        self.samples_size = 0  # 样本文件中已被检查点确认的字节数，load() 时更新
+        self.file = None
+        self.open_segment()
+
+    @property
+    def checkpoint_path(self):
+        return os.path.join(self.directory, 'checkpoint.json')
+
+    @property
+    def samples_path(self):
+        return os.path.join(self.directory, 'samples.log')
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f'journal_{segment:06d}.log')
+
+    def segments(self):
+        segments = []
+        for filename in os.listdir(self.directory):
+            if filename.startswith('journal_') and filename.endswith('.log'):
+                segments.append(int(filename[8:-4]))
+        return sorted(segments)
+
+    def open_segment(self):
+        path = self.segment_path(self.segment)
+        # 崩溃时最后一行可能只写了一半，先补上换行，避免和新写入的内容连在一起
+        torn = False
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+                torn = file.read(1) != b'\n'
+        self.file = open(path, 'a', encoding='utf-8')
+        if torn:
+            self.file.write('\n')
+        self.last_sync = time.monotonic()
+
+    def append(self, entry):
+        self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.file.flush()
+        now = time.monotonic()
+        if now - self.last_sync >= self.fsync_interval:
+            os.fsync(self.file.fileno())
+            self.last_sync = now
+
+    def record_line(self, line):
+        self.append({'type': 'line', 'line': line})
+
+    def record_state(self, state):
+        self.append({'type': 'state', 'state': state})
+
+    def checkpoint(self, header, samples):
+        # 先切换到新的日志分段，再追加新样本块，然后原子地替换检查点，最后删除检查点已包含的旧分段；
+        # 任何一步中断，旧检查点（只认样本文件的旧长度）加上全部分段仍然可以完整恢复
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.segment += 1
+        self.open_segment()
+        with open(self.samples_path, 'ab') as file:
+            file.truncate(self.samples_size)  # 丢弃上次中断时写了一半、未被检查点确认的块
+            if samples:
+                file.write((json.dumps(samples, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8'))
+            file.flush()
+            os.fsync(file.fileno())
+            samples_size = file.tell()
+        header['segment'] = self.segment
+        header['samples_size'] = samples_size
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(header, file, ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+        self.samples_size = samples_size
+        for segment in self.segments():
+            if segment < self.segment:
+                os.remove(self.segment_path(segment))
+
+    def load(self):
+        # 返回 (检查点, 检查点已包含的样本, 检查点之后的日志条目)，没有可恢复的会话时返回 (None, [], [])
+        checkpoint = None
+        if os.path.exists(self.checkpoint_path):
+            try:
+                with open(self.checkpoint_path, encoding='utf-8') as file:
+                    checkpoint = json.load(file)
+            except ValueError as e:
+                print(f"检查点损坏，仅从日志恢复: {e}")
+        first_segment = checkpoint['segment'] if checkpoint else 0
+        self.samples_size = checkpoint['samples_size'] if checkpoint else 0
+        samples = []
+        if self.samples_size:
+            with open(self.samples_path, 'rb') as file:
+                for chunk in file.read(self.samples_size).splitlines():
+                    samples.extend(json.loads(chunk))
+        entries = []
+        for segment in self.segments():
+            if segment < first_segment:
+                continue
+            with open(self.segment_path(segment), encoding='utf-8', errors='replace') as file:
+                for line in file:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue  # 崩溃时写了一半的行
+        return checkpoint, samples, entries
+
+    def reset(self):
+        # 开始新的会话，删除检查点和全部日志
+        self.file.close()
+        for segment in self.segments():
+            os.remove(self.segment_path(segment))
+        for path in (self.checkpoint_path, self.samples_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.segment = 0
+        self.samples_size = 0
+        self.open_segment()
+
+    def close(self):
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+# 会话最后一次写入距今超过该时间（秒）时，启动时先询问操作员是否恢复
+SESSION_STALE_SECONDS = 1800
+# 飞行时间回退超过该值（秒）视为新的一次飞行，自动新建会话；回退较少的数据视为乱序，忽略
+FLIGHT_RESET_SECONDS = 60
 
 
 class SerialReader(QMainWindow):
@@ -32,24 +850,30 @@ class SerialReader(QMainWindow):
         super().__init__()
         self.initUI()
 
-        self.serial = None
-        self.is_reading = False  # 控制线程状态
-
-        self.latitudes = []
-        self.longitudes = []
-        self.altitudes = []
-        self.discharge_volume = []
-        self.gas_volume = []
-        self.times = []
+        self.is_reading = False  # 控制采集进程状态
+        self.ring = None  # 与采集进程共享的环形缓冲区
+        self.ingest_process = None
+        self.ingest_stop_event = None
+        self.outbound = None  # 上行指令队列，由采集进程写入串口
+        self.ingest_timer = QTimer()  # 定时从共享内存读取采集进程发布的数据
+        self.ingest_timer.timeout.connect(self.poll_ingest)
+        self.uplink = None  # 上行指令通道，串口打开后创建
+        self.broadcaster = None  # 局域网实时数据广播
+
+        self.reset_flight_data()
         self.start_time = QTime.currentTime()
         self.token = ""  # 新增变量用于存储token
-        self.update_timer = QTimer()  # 创建一个定时器，用于更新地图和绘图
-        self.update_timer.timeout.connect(self.update_all)  # 连接定时器的 timeout 信号到 update_all 方法
-        self.current_data = []  # 用于存储当前数据的实例变量
         self.dataProcessor = DataProcessor()  # 初始化 DataProcessor
         self.dataProcessor.dataUpdated.connect(self.update_all)  # 连接信号
+        self.dataProcessor.commandStatus.connect(self.update_command_status)
+        self.dataProcessor.commandStatus.connect(lambda message: self.save_session_state())  # 指令队列有变化
+        self.dataProcessor.commandLatency.connect(self.update_command_latency)
+        self.dataProcessor.metricsUpdated.connect(self.update_metrics)
+        self.dataProcessor.alertRaised.connect(self.show_alert)
         self.token_timer = QTimer()  # 创建一个定时器，用于定时获取令牌
         self.token_timer.timeout.connect(self.get_token)  # 连接定时器的 timeout 信号到 get_token 方法
+        self.data_send_timer = QTimer()  # 定时向后端发送数据
+        self.data_send_timer.timeout.connect(self.send_real_time_data)  # 连接定时器的 timeout 信号到 send_real_time_data 方法
         self.token_url = ""  # 存储获取令牌的URL
         self.real_time_url = ""
         self.data_updated = False  # 新增标志位
@@ -60,6 +884,37 @@ class SerialReader(QMainWindow):
         font.setPointSize(10)  # 设置字体大小
         self.data_text_edit.setFont(font)
 
+        # 会话日志，启动时自动恢复上次未结束的会话
+        self.restoring = False  # 恢复期间不重复写日志、不自动保存 Excel
+        self.restored_commands = []  # 恢复出的从未发送的上行指令：[内容, 优先级]，打开串口后重新排队
+        self.restored_uplink_seq = 0
+        self.journal = SessionJournal()
+        self.restore_session()
+        self.checkpoint_timer = QTimer()  # 定时写检查点
+        self.checkpoint_timer.timeout.connect(self.checkpoint_if_changed)
+        self.checkpoint_timer.start(60000)
+
+    def reset_flight_data(self):
+        self.latitudes = []
+        self.longitudes = []
+        self.altitudes = []
+        self.discharge_volume = []
+        self.gas_volume = []
+        self.times = []
+        # 曲线数据的多级降采样，用于全程缩放浏览
+        self.altitude_series = MinMaxPyramid()
+        self.gas_volume_series = MinMaxPyramid()
+        self.discharge_volume_series = MinMaxPyramid()
+        self.plot_series = [(self.altitude_line, self.altitude_series),
+                            (self.gas_volume_line, self.gas_volume_series),
+                            (self.discharge_volume_line, self.discharge_volume_series)]
+        self.metrics_engine = MetricsEngine()  # 衍生指标计算
+        self.derived_values = dict(self.metrics_engine.values)  # 最新的衍生指标
+        self.metrics_history = []  # 每个样本对应的衍生指标，用于导出
+        self.records = []  # 每个样本拆分后的 MXX 字段，用于导出
+        self.checkpointed_count = 0  # 已写入检查点样本文件的样本数
+        self.current_data = []  # 用于存储当前数据的实例变量
+
     def initUI(self):
         self.setWindowTitle('浮空器控制平台')
         # URL输入框
@@ -70,6 +925,14 @@ class SerialReader(QMainWindow):
         self.real_time_url_label = QLabel('发送实时数据URL:')
         self.real_time_url_edit = QTextEdit()
         self.real_time_url_edit.setMaximumHeight(30)
+
+        self.broadcast_port_label = QLabel('广播端口:')
+        self.broadcast_port_edit = QTextEdit('8765')
+        self.broadcast_port_edit.setMaximumHeight(30)
+        self.broadcast_button = QPushButton('启动广播')
+        self.broadcast_button.clicked.connect(self.toggle_broadcast)
+        self.new_session_button = QPushButton('新建会话')
+        self.new_session_button.clicked.connect(self.new_session)
         # 串口设置相关控件
         self.port_label = QLabel('串口:')
         self.baudrate_label = QLabel('波特率:')
@@ -83,8 +946,17 @@ class SerialReader(QMainWindow):
         self.ballast_send_edit = QTextEdit()
         self.ballast_send_edit.setMaximumHeight(30)
 
+        self.urgent_check = QCheckBox('紧急指令(优先发送)')
         self.send_button = QPushButton('发送数据')
         self.send_button.clicked.connect(self.send_serial_data)
+        self.command_status_label = QLabel('指令状态: 无')
+        self.command_latency_label = QLabel('指令往返时延: -- ms')
+
+        # 衍生指标模块
+        self.metric_labels = {}
+        for key, name, unit, _, _ in DERIVED_METRICS:
+            self.metric_labels[key] = QLabel(f'{name}: --')
+        self.alert_label = QLabel('告警: 无')
 
         # 操作按钮
         self.start_button = QPushButton('开始读取')
@@ -92,41 +964,31 @@ class SerialReader(QMainWindow):
         self.start_button.clicked.connect(self.start_reading)
         self.stop_button.clicked.connect(self.stop_reading)
 
-        self.rc_task_status_label = QLabel('RC任务状态: 待命')
-        self.cutter_status_label = QLabel('切断器状态: 未激活')
-        self.battery_voltage_status_label = QLabel('电池电压状态: 正常')
-        self.timeout_status_label = QLabel('超时状态: 未超时')
-        self.ultra_high_status_label = QLabel('超高状态: 正常')
-        self.ultra_fence_status_label = QLabel('超围栏状态: 正常')
-        self.active_cutting_status_label = QLabel('主动切断状态: 未切断')
-
-        # 飞行参数模块
-        self.horizontal_speed_label = QLabel('水平速度: 0 m/s')
-        self.climbing_speed_label = QLabel('上升速度: 0 m/s')
-        self.z_acceleration_label = QLabel('z加速度: 0 m/s^2')
-        self.longitude_label = QLabel('经度: 0.0')
-        self.latitude_label = QLabel('纬度: 0.0')
-        self.fusion_altitude_label = QLabel('融合高度: 0 米')
-        self.pressure_altitude_label = QLabel('气压高度: 0 米')
-        self.gps_altitude_label = QLabel('GPS高度: 0 米')
-        self.target_altitude_label = QLabel('目标平飘高度: 0 米')
-        self.pt100_temperature_label = QLabel('PT100温度: 0 度')
-        self.board_temperature_label = QLabel('板上温度: 0 度')
-        self.battery_temperature_label = QLabel('电池温度: 0 度')
-        self.battery_voltage_label = QLabel('GPS2高度: 0 米')
-        self.capacitor_voltage_label = QLabel('电容电压: 0 V')
-        self.venting_time_label = QLabel('排气时间: 0 秒')
-        self.ballast_quantity_label = QLabel('抛物量: 0 个')
-        self.message_label = QLabel('北斗上发消息量:0')
-        self.time_label = QLabel('时间:0:00')
+        # 状态位和飞行参数标签由遥测字段表生成，只在数值变化时刷新
+        self.telemetry_model = TelemetryModel(TELEMETRY_FIELDS)
+        self.telemetry_labels = {}
+        for field in self.telemetry_model.fields:
+            label = QLabel()
+            self.telemetry_labels[field.key] = label
+            self.telemetry_model.bind(field.key, label)
+        self.telemetry_model.reset()
+        self.time_label = self.telemetry_labels['time']
+        self.telemetry_timer = QTimer()  # 每帧把变化的字段刷新到界面
+        self.telemetry_timer.timeout.connect(self.telemetry_model.flush)
+        self.telemetry_timer.start(50)
         # 地图显示窗口
         self.map_view = QWebEngineView()
 
         # 高度曲线显示
         self.canvas = FigureCanvas(plt.Figure())
         self.ax_altitude = self.canvas.figure.add_subplot(311)
-        self.ax_gas_volume = self.canvas.figure.add_subplot(312)
-        self.ax_discharge_volume = self.canvas.figure.add_subplot(313)
+        self.ax_gas_volume = self.canvas.figure.add_subplot(312, sharex=self.ax_altitude)
+        self.ax_discharge_volume = self.canvas.figure.add_subplot(313, sharex=self.ax_altitude)
+        self.plot_toolbar = NavigationToolbar2QT(self.canvas, self)  # 平移/缩放工具栏
+        self.follow_check = QCheckBox('跟随最新数据(显示全程)')
+        self.follow_check.setChecked(True)
+        self.follow_check.stateChanged.connect(lambda state: self.plot_data())
+        self.init_plot()  # 会连接 xlim_changed 回调，需在 follow_check 创建之后
         # 添加获取令牌按钮
         self.get_token_button = QPushButton('获取令牌')
 
@@ -142,39 +1004,23 @@ class SerialReader(QMainWindow):
         grid.addWidget(self.stop_button, 3, 0, 1, 2)
 
         grid.addWidget(QLabel('状态位信息'), 4, 0)
-        grid.addWidget(self.rc_task_status_label, 5, 0, 1, 2)
-        grid.addWidget(self.cutter_status_label, 6, 0, 1, 2)
-        grid.addWidget(self.battery_voltage_status_label, 7, 0, 1, 2)
-        grid.addWidget(self.timeout_status_label, 8, 0, 1, 2)
-        grid.addWidget(self.ultra_high_status_label, 9, 0, 1, 2)
-        grid.addWidget(self.ultra_fence_status_label, 10, 0, 1, 2)
-        grid.addWidget(self.active_cutting_status_label, 11, 0, 1, 2)
+        for row, field in enumerate(STATUS_FIELDS, start=5):
+            grid.addWidget(self.telemetry_labels[field.key], row, 0, 1, 2)
 
         # 添加飞行参数标签到布局
         grid.addWidget(QLabel('飞行参数'), 12, 0)
-        grid.addWidget(self.horizontal_speed_label, 13, 0, 1, 2)
-        grid.addWidget(self.climbing_speed_label, 14, 0, 1, 2)
-        grid.addWidget(self.z_acceleration_label, 15, 0, 1, 2)
-        grid.addWidget(self.longitude_label, 16, 0, 1, 2)
-        grid.addWidget(self.latitude_label, 17, 0, 1, 2)
-        grid.addWidget(self.fusion_altitude_label, 18, 0, 1, 2)
-        grid.addWidget(self.pressure_altitude_label, 19, 0, 1, 2)
-        grid.addWidget(self.gps_altitude_label, 20, 0, 1, 2)
-        grid.addWidget(self.target_altitude_label, 21, 0, 1, 2)
-        grid.addWidget(self.pt100_temperature_label, 22, 0, 1, 2)
-        grid.addWidget(self.board_temperature_label, 23, 0, 1, 2)
-        grid.addWidget(self.battery_temperature_label, 24, 0, 1, 2)
-        grid.addWidget(self.battery_voltage_label, 25, 0, 1, 2)
-        grid.addWidget(self.capacitor_voltage_label, 26, 0, 1, 2)
-        grid.addWidget(self.venting_time_label, 27, 0, 1, 2)
-        grid.addWidget(self.ballast_quantity_label, 28, 0, 1, 2)
-        grid.addWidget(self.message_label, 29, 0, 1, 2)
+        for row, field in enumerate(FLIGHT_FIELDS, start=13):
+            grid.addWidget(self.telemetry_labels[field.key], row, 0, 1, 2)
         grid.addWidget(self.get_token_button, 30, 0, 1, 2)  # 添加按钮到布局
 
         grid.addWidget(self.token_url_label, 32, 0)
         grid.addWidget(self.token_url_edit, 32, 1)
         grid.addWidget(self.real_time_url_label, 33, 0)
         grid.addWidget(self.real_time_url_edit, 33, 1)
+        grid.addWidget(self.broadcast_port_label, 34, 0)
+        grid.addWidget(self.broadcast_port_edit, 34, 1)
+        grid.addWidget(self.broadcast_button, 35, 0, 1, 2)
+        grid.addWidget(self.new_session_button, 36, 0, 1, 2)
         # 添加按钮到布局
 
         data_layout = QVBoxLayout()
@@ -190,8 +1036,17 @@ class SerialReader(QMainWindow):
         self.send_layout.addWidget(self.ballast_send_label)
         self.send_layout.addWidget(self.ballast_send_edit)
         self.send_layout.addWidget(self.time_label)
+        self.send_layout.addWidget(self.urgent_check)
         self.send_layout.addWidget(self.send_button)
+        self.send_layout.addWidget(self.command_status_label)
+        self.send_layout.addWidget(self.command_latency_label)
+        self.send_layout.addWidget(QLabel('衍生指标'))
+        for label in self.metric_labels.values():
+            self.send_layout.addWidget(label)
+        self.send_layout.addWidget(self.alert_label)
         self.send_layout.addWidget(QLabel('数据曲线'))
+        self.send_layout.addWidget(self.follow_check)
+        self.send_layout.addWidget(self.plot_toolbar)
         self.send_layout.addWidget(self.canvas)
 
         main_layout = QHBoxLayout()
@@ -218,84 +1073,178 @@ class SerialReader(QMainWindow):
         baudrate = int(self.baudrate_box.currentText())
         self.token_url = self.token_url_edit.toPlainText().strip()
         self.real_time_url = self.real_time_url_edit.toPlainText().strip()
+        # 串口由单独的采集进程读取，界面进程中的地图、绘图、保存 Excel 不会延误串口读取
+        self.ring = SharedRingBuffer()
+        # 以 spawn 方式启动，子进程不继承界面进程中 Qt 和各线程的状态
+        context = multiprocessing.get_context('spawn')
+        self.outbound = context.Queue()
+        self.ingest_stop_event = context.Event()
+        self.ingest_process = context.Process(
+            target=ingest_process_main,
+            args=(self.ring.name, port, baudrate, self.outbound, self.ingest_stop_event, "serial_data_log.txt"),
+            daemon=True)
         try:
-            self.serial = serial.Serial(port, baudrate, timeout=1)
-        except serial.SerialException as e:
-            print(f"无法打开串口: {e}")
-            self.is_reading = False  # 反映串口打开失败的状态
-            # 这里可以添加代码来通知用户串口打开失败
-            return  # 退出方法，因为串口打开失败
+            self.ingest_process.start()
+        except Exception as e:  # 捕获进程启动可能的异常
+            print(f"采集进程启动失败: {e}")
+            self.ring.close()
+            self.ring = None
+            return
 
         self.is_reading = True
-        try:
-            threading.Thread(target=self.read_serial_data, daemon=True).start()  # 启动线程
-        except Exception as e:  # 捕获线程启动可能的异常
-            print(f"线程启动失败: {e}")
-            self.is_reading = False  # 反映线程启动失败的状态
-            # 这里可以添加代码来通知用户线程启动失败
+        self.uplink = CommandUplink(self.outbound.put, self.dataProcessor,
+                                    max_retries=UPLINK_MAX_RETRIES, tag_ids=UPLINK_TAG_IDS)
+        self.uplink.seq = self.restored_uplink_seq
+        self.uplink.start()
+        self.ingest_timer.start(20)
+        # 恢复的会话中从未发送过的指令重新排队
+        for payload, priority in self.restored_commands:
+            self.uplink.submit(payload, priority)
+        self.restored_commands = []
+        self.save_session_state()
 
     def stop_reading(self):
-        self.is_reading = False
+        if not self.is_reading:
+            return
+        self.shutdown_ingest()
         self.save_to_excel()
-        if self.serial:
-            self.serial.close()
+        self.write_checkpoint()
 
+    def shutdown_ingest(self):
+        # 停止采集进程，取走剩余数据并释放共享内存
+        self.is_reading = False
+        self.ingest_timer.stop()
+        if self.uplink:
+            self.uplink.stop()
+            # 停止读取后从未发送的指令保留到下次打开串口，已发送未确认的交由操作员判断
+            unsent, in_flight = self.uplink.snapshot()
+            for command in in_flight:
+                self.uplink.notify(f"指令#{command['seq']}已发送但未确认，不会自动重发: {command['payload']}")
+            self.restored_commands = [[c['payload'], c['priority']] for c in unsent]
+            self.restored_uplink_seq = self.uplink.seq
+            self.uplink = None
+        self.ingest_stop_event.set()
+        self.ingest_process.join(2)
+        if self.ingest_process.is_alive():
+            # 采集进程卡在串口操作中未能按时退出，强制结束后再释放共享内存
+            print("采集进程未能按时退出，强制结束")
+            self.ingest_process.terminate()
+            self.ingest_process.join()
+        self.poll_ingest()  # 取走采集进程退出前发布的数据
+        self.ring.close()
+        self.ring = None
 
     def send_serial_data(self):
-        if self.serial and self.serial.isOpen():
-            ballast_value = self.ballast_send_edit.toPlainText()
-
-            data_to_send = f"{ballast_value}\r\n"  # 需要回车换行
-            self.serial.write(data_to_send.encode())
-            print(f"发送数据: {data_to_send}")
-
-    def read_serial_data(self):
-        file_path = "serial_data_log.txt"
-        while self.is_reading:
-            if self.serial.in_waiting:
-                line = self.serial.readline().decode('utf-8', errors='replace').strip()
-                print(f"Received line: {line}")
-                with open(file_path, "a", encoding='utf-8') as file:
-                    file.write(line + '\n')
-
-                self.data_count += 1  # 增加数据计数
-                if self.data_count >= self.save_threshold:
-                    self.save_to_excel()  # 达到阈值，保存数据
-                    self.data_count = 0  # 重置计数器
-                current_time = datetime.now()  # 获取当前时间
-                formatted_time = current_time.strftime("%Y-%m-%d %H:%M:%S")  # 格式化时间
-
-                # 创建包含时间和数据的字符串，并添加换行符
-
-                if line.startswith('MXX'):
-                    data = line.split(',')
-                    if len(data) == 21:
-                        lat, lon, alt = float(data[8]), float(data[7]), float(data[10])
-                        discharge, gas_volume = float(data[18]), float(data[19])
-                        time_str = data[2]
-                        hours, minutes, seconds = int(time_str[0:2]), int(time_str[2:4]), int(time_str[4:6])
-                        time_in_seconds = hours * 3600 + minutes * 60 + seconds
-                        data_with_time = f"{formatted_time}\n {line}\n"
-                        self.data_text_edit.append(data_with_time)
-                        # 只有当经纬度不为0时，才添加到数组中
-                        if lat != 0 and lon != 0:
-                            self.latitudes.append(lat)
-                            self.longitudes.append(lon)
-
-                        self.altitudes.append(alt)
-                        self.discharge_volume.append(discharge)
-                        self.gas_volume.append(gas_volume)
-                        self.times.append(time_in_seconds)
-
-                        self.update_timer.start(1000)  # 启动定时器，每 100 毫秒更新一次
-                        self.data_updated = True
-                        self.current_data = data  # 更新当前数据
-                        self.dataProcessor.dataUpdated.emit(data)  #
-                        print(f"纬度: {lat}, 经度: {lon}")
-
-                else:
-                    # 如果不是 MXX 数据行，只显示原始数据
-                    self.data_text_edit.append(line)
+        if self.uplink and self.is_reading:
+            ballast_value = self.ballast_send_edit.toPlainText().strip()
+            if not ballast_value:
+                return
+            # 交给发送线程排队发送，不在界面线程中阻塞写串口
+            priority = CommandUplink.PRIORITY_URGENT if self.urgent_check.isChecked() else CommandUplink.PRIORITY_NORMAL
+            self.uplink.submit(ballast_value, priority)
+
+    def update_command_status(self, message):
+        self.command_status_label.setText(f'指令状态: {message}')
+
+    def update_command_latency(self, latency, mean_latency):
+        self.command_latency_label.setText(f'指令往返时延: {latency:.0f} ms (平均 {mean_latency:.0f} ms)')
+
+    def poll_ingest(self):
+        if self.ring is None:
+            return
+        latest_data = None
+        for kind, line, fields in self.ring.read():
+            if kind == SharedRingBuffer.KIND_ERROR:
+                print(line)
+                self.stop_reading()
+                return
+            if kind == SharedRingBuffer.KIND_MXX:
+                if self.time_step(line) < -FLIGHT_RESET_SECONDS:
+                    self.start_new_flight(line)
+                self.journal.record_line(line)  # 先写日志再处理
+            data = self.process_line(kind, line, fields)
+            if data is not None:
+                latest_data = data
+        # 一批数据只刷新一次界面
+        if latest_data is not None:
+            self.dataProcessor.dataUpdated.emit(latest_data)
+
+    def time_step(self, line):
+        # 该 MXX 数据行相对上一条数据的飞行时间变化（秒），时间回退时为负
+        if self.metrics_engine.last_time is None:
+            return 0
+        return self.metrics_engine.flight_time(clock_seconds(line.split(',')[2])) - self.metrics_engine.last_time
+
+    def start_new_flight(self, line):
+        # 飞行时间大幅回退：下位机重新开始计时，或恢复的是上一次飞行的会话，
+        # 继续使用当前会话会使时间轴倒退，保存当前数据后另起会话
+        message = f"飞行时间回退 {-self.time_step(line):.0f} 秒，已保存上一会话的数据并新建会话"
+        self.save_to_excel()
+        self.clear_session()
+        self.save_session_state()
+        self.dataProcessor.alertRaised.emit(message)
+
+    def process_line(self, kind, line, fields):
+        # 处理采集进程发布的一行数据，MXX 数据行返回拆分后的字段
+        print(f"Received line: {line}")
+
+        self.data_count += 1  # 增加数据计数
+        if self.data_count >= self.save_threshold and not self.restoring:
+            self.save_to_excel()  # 达到阈值，保存数据
+            self.data_count = 0  # 重置计数器
+        current_time = datetime.now()  # 获取当前时间
+        formatted_time = current_time.strftime("%Y-%m-%d %H:%M:%S")  # 格式化时间
+
+        data = line.split(',') if kind == SharedRingBuffer.KIND_MXX else None
+        if data is not None and len(data) != 21:
+            kind = SharedRingBuffer.KIND_LINE  # 字段不全，只显示原始数据
+        elif data is not None and self.time_step(line) < 0:
+            # 时间早于上一条的乱序数据不能加入曲线和指标，它们要求时间单调
+            print(f"数据时间早于上一条，已忽略: {data[2]}")
+            kind = SharedRingBuffer.KIND_LINE
+        if kind == SharedRingBuffer.KIND_MXX:
+            lat, lon, alt = fields[8], fields[7], fields[10]
+            discharge, gas_volume = fields[18], fields[19]
+            time_in_seconds = clock_seconds(data[2])
+            # 创建包含时间和数据的字符串，并添加换行符
+            data_with_time = f"{formatted_time}\n {line}\n"
+            self.data_text_edit.append(data_with_time)
+            # 只有当经纬度不为0时，才添加到数组中
+            if lat != 0 and lon != 0:
+                self.latitudes.append(lat)
+                self.longitudes.append(lon)
+
+            self.altitudes.append(alt)
+            self.discharge_volume.append(discharge)
+            self.gas_volume.append(gas_volume)
+            self.times.append(time_in_seconds)
+            self.records.append(data)
+
+            # 增量更新衍生指标和告警
+            metrics, alerts = self.metrics_engine.update(data, time_in_seconds)
+            flight_time = self.metrics_engine.last_time
+            self.altitude_series.append(flight_time, alt)
+            self.gas_volume_series.append(flight_time, gas_volume)
+            self.discharge_volume_series.append(flight_time, discharge)
+            self.derived_values = metrics
+            self.metrics_history.append(metrics)
+            self.dataProcessor.metricsUpdated.emit(metrics)
+            for alert in alerts:
+                self.dataProcessor.alertRaised.emit(alert)
+            if self.broadcaster:
+                self.broadcaster.publish(mxx_record(data, metrics))
+
+            self.data_updated = True
+            self.current_data = data  # 更新当前数据
+            print(f"纬度: {lat}, 经度: {lon}")
+            return data
+        elif self.uplink and self.uplink.handle_line(line):
+            # 指令应答行，由上行指令通道处理
+            self.data_text_edit.append(line)
+        else:
+            # 如果不是 MXX 数据行，只显示原始数据
+            self.data_text_edit.append(line)
+        return None
 
     def update_all(self, data):
         # 使用传入的 data 参数进行更新
@@ -303,38 +1252,19 @@ class SerialReader(QMainWindow):
         self.update_map()
         self.plot_data()
 
-    def update_system_status(self, data):
-        status = data[3]
-        # 更新状态位信息
-        self.rc_task_status_label.setText(f'RC任务状态: {data[3]}')
-        self.cutter_status_label.setText(f'切断器状态:{status[1]} ')
-        self.battery_voltage_status_label.setText(f'电池电压状态:{status[2]} ')
-        self.timeout_status_label.setText(f'超时状态: {status[3]} ')
-        self.ultra_high_status_label.setText(f'超高状态:{status[4]}  ')
-        self.ultra_fence_status_label.setText(f'超围栏状态:{status[5]} ')
-        self.active_cutting_status_label.setText(f'主动切断状态:{status[6]} ')
-
-        # 更新飞行参数
-        # 更新飞行参数
-        self.horizontal_speed_label.setText(f'水平速度: {data[4]} m/s')
-        self.climbing_speed_label.setText(f'上升速度: {data[5]} m/s')
-        self.z_acceleration_label.setText(f'z加速度: {data[6]} m/s^2')
-        self.longitude_label.setText(f'经度: {data[7]}')
-        self.latitude_label.setText(f'纬度: {data[8]}')
-        self.fusion_altitude_label.setText(f'融合高度: {data[9]} 米')
-        self.pressure_altitude_label.setText(f'气压高度: {data[10]} 米')
-        self.gps_altitude_label.setText(f'GPS高度: {data[11]} 米')
-        self.target_altitude_label.setText(f'目标平飘高度: {data[13]} 米')
-        self.pt100_temperature_label.setText(f'PT100温度: {data[14]} 度')
-        self.board_temperature_label.setText(f'板上温度: {data[15]} 度')
-        self.battery_temperature_label.setText(f'GPS2高度: {data[12]} 米')
-        self.battery_voltage_label.setText(f'电池电压: {data[16]}  V')
-        self.capacitor_voltage_label.setText(f'电容电压: {data[17]} V')
-        self.venting_time_label.setText(f'排气时间: {data[18]} 秒')
-        self.ballast_quantity_label.setText(f'抛物量: {data[19]} 个')
-        self.message_label.setText((f'北斗上发消息量:{data[20]}'))
-        self.time_label.setText((f'时间:{data[2]}'))
+    def update_metrics(self, values):
+        for key, name, unit, _, _ in DERIVED_METRICS:
+            self.metric_labels[key].setText(f'{name}: {format_metric(values[key], unit)}')
+
+    def show_alert(self, message):
+        alert_text = f'告警: {message} ({datetime.now().strftime("%H:%M:%S")})'
+        self.alert_label.setText(alert_text)
+        self.data_text_edit.append(alert_text)
+        print(alert_text)
 
+    def update_system_status(self, data):
+        # 只记录变化的字段，由 telemetry_timer 统一刷新界面
+        self.telemetry_model.update(data)
 
     def update_map(self):
 
@@ -359,42 +1289,63 @@ class SerialReader(QMainWindow):
         else:
             print("没有足够的数据来更新地图")  # 用于调试
 
-    def plot_data(self):
-        self.ax_altitude.clear()
-        self.ax_gas_volume.clear()
-        self.ax_discharge_volume.clear()
-        # 只取最近的15个数据点
-        if len(self.times) > 15:
-            time_labels = [f'{int(t // 3600):02}:{int((t % 3600) // 60):02}:{int(t % 60):02}' for t in self.times[-15:]]
-            altitudes = self.altitudes[-15:]
-            gas_volumes = self.gas_volume[-15:]
-            discharge_volumes = self.discharge_volume[-15:]
-        else:
-            time_labels = [f'{int(t // 3600):02}:{int((t % 3600) // 60):02}:{int(t % 60):02}' for t in self.times]
-            altitudes = self.altitudes
-            gas_volumes = self.gas_volume
-            discharge_volumes = self.discharge_volume
-
-        self.ax_altitude.plot(time_labels, altitudes, label='Altitude')
-        self.ax_altitude.set_xlabel('Time (HH:MM:SS)', fontsize=8)
+    def init_plot(self):
+        # 曲线对象只创建一次，之后只更新数据，避免每次重绘坐标轴
+        self.updating_view = False  # 程序设置坐标范围时为 True，用于区分用户的平移/缩放
+        self.altitude_line, = self.ax_altitude.plot([], [], label='Altitude')
         self.ax_altitude.set_ylabel('Altitude (m)', fontsize=10)
-        self.ax_altitude.tick_params(axis='both', labelsize=5)  # 设置刻度字体大小
-        self.ax_altitude.legend(fontsize=6)
 
-        self.ax_gas_volume.plot(time_labels, gas_volumes, label='Discharge Volume', color='green')
-        self.ax_gas_volume.set_xlabel('Time (HH:MM:SS)', fontsize=8)
+        self.gas_volume_line, = self.ax_gas_volume.plot([], [], label='Discharge Volume', color='green')
         self.ax_gas_volume.set_ylabel('Discharge(%)', fontsize=10)
-        self.ax_gas_volume.tick_params(axis='both', labelsize=5)
-        self.ax_gas_volume.legend(fontsize=6)
 
-        self.ax_discharge_volume.plot(time_labels, discharge_volumes, label='Gas Volume', color='red')
-        self.ax_discharge_volume.set_xlabel('Time (HH:MM:SS)', fontsize=8)
+        self.discharge_volume_line, = self.ax_discharge_volume.plot([], [], label='Gas Volume', color='red')
         self.ax_discharge_volume.set_ylabel('Gas(%)', fontsize=10)
-        self.ax_discharge_volume.tick_params(axis='both', labelsize=5)
-        self.ax_discharge_volume.legend(fontsize=6)
 
-        plt.tight_layout()  # 自动调整子图参数，使之填充整个图像区域
-        self.canvas.draw()
+        for ax in (self.ax_altitude, self.ax_gas_volume, self.ax_discharge_volume):
+            ax.set_xlabel('Time (HH:MM:SS)', fontsize=8)
+            ax.xaxis.set_major_formatter(FuncFormatter(format_clock))
+            ax.tick_params(axis='both', labelsize=5)  # 设置刻度字体大小
+            ax.legend(fontsize=6)
+        # tight_layout 会触发 xlim_changed，不能当作用户操作
+        self.updating_view = True
+        self.canvas.figure.tight_layout()  # 自动调整子图参数，使之填充整个图像区域
+        self.updating_view = False
+        self.ax_altitude.callbacks.connect('xlim_changed', self.on_xlim_changed)
+
+    def on_xlim_changed(self, ax):
+        if self.updating_view:
+            return
+        # 用户平移或缩放后停止跟随，按新的范围重新降采样
+        if self.follow_check.isChecked():
+            self.follow_check.blockSignals(True)
+            self.follow_check.setChecked(False)
+            self.follow_check.blockSignals(False)
+        self.refresh_plot_view()
+
+    def plot_data(self):
+        series_x = self.altitude_series.x
+        if not series_x:
+            return
+        if self.follow_check.isChecked():
+            # 跟随模式下显示从起飞到当前的全程数据
+            x0, x1 = series_x[0], series_x[-1]
+            self.updating_view = True
+            self.ax_altitude.set_xlim(x0, x1 if x1 > x0 else x0 + 1)  # 三个子图共享横轴
+            self.updating_view = False
+        self.refresh_plot_view()
+
+    def refresh_plot_view(self):
+        if not hasattr(self, 'plot_series'):  # 界面初始化时 reset_flight_data 尚未创建曲线数据
+            return
+        x0, x1 = self.ax_altitude.get_xlim()
+        width = max(int(self.ax_altitude.bbox.width), 1)
+        for line, series in self.plot_series:
+            # 每个像素列保留最小值和最大值两个点
+            xs, ys = series.query(x0, x1, width * 2)
+            line.set_data(xs, ys)
+            line.axes.relim()
+            line.axes.autoscale_view(scalex=False)
+        self.canvas.draw_idle()
 
     def init_map(self):
         # 初始化地图（世界地图）
@@ -403,6 +1354,22 @@ class SerialReader(QMainWindow):
         self.map.save(data, close_file=False)
         self.map_view.setHtml(data.getvalue().decode())
 
+    def toggle_broadcast(self):
+        if self.broadcaster:
+            self.broadcaster.stop()
+            self.broadcaster = None
+            self.broadcast_button.setText('启动广播')
+            return
+        try:
+            port = int(self.broadcast_port_edit.toPlainText().strip())
+            broadcaster = TelemetryBroadcaster(port)
+            broadcaster.start()
+        except (ValueError, OSError) as e:
+            print(f"无法启动实时数据广播: {e}")
+            return
+        self.broadcaster = broadcaster
+        self.broadcast_button.setText('停止广播')
+
     def start_get_token(self):
         if self.token_timer.isActive():
             self.token_timer.stop()  # 停止定时器
@@ -428,10 +1395,8 @@ class SerialReader(QMainWindow):
                     print("令牌获取成功:", self.token)
 
                     self.token_timer.stop()  # 停止获取令牌的定时器
-                    self.data_send_timer = QTimer()  # 创建一个新的定时器用于发送数据
-                    self.data_send_timer.timeout.connect(
-                        self.send_real_time_data)  # 连接定时器的 timeout 信号到 send_real_time_data 方法
                     self.data_send_timer.start(1000)  # 启动定时器，每1000毫秒发送一次数据
+                    self.save_session_state()
 
                 else:
                     print("令牌获取失败:", response_data.get("msg"))
@@ -453,6 +1418,8 @@ class SerialReader(QMainWindow):
         if not self.token:
             print("令牌未获取或已失效")
 
+            return
+        if not self.current_data:  # 新建会话后尚未收到数据
             return
         if self.token and self.data_updated:
             try:
@@ -462,24 +1429,9 @@ class SerialReader(QMainWindow):
                 data = {
                     "taskId": "test",
                     "status": "1",
-                    "longitude": self.current_data[7],
-                    "groundSpeed": self.current_data[4],
-                    "climbSpeed": self.current_data[5],
-                    "acceleratedSpeed": self.current_data[6],
-                    "latitude": self.current_data[8],
-                    "fusionAltitude": self.current_data[9],
-                    "pressureAltitude": self.current_data[10],
-                    "gpsAltitude": self.current_data[11],
-                    "targetAltitude": self.current_data[13],
-                    "pt100Temperature": self.current_data[14],
-                    "pcbTemperature": self.current_data[15],
-                    # "batteryTemperature": self.current_data[]
-                    "batteryVoltage": self.current_data[16],
-                    "capacitorVoltage": self.current_data[17],
-                    "ventingTime": self.current_data[18],
-                    "ballastDropping": self.current_data[19],
-
-                    "time": self.current_data[2],
+                    # 后端接口一直按原始文本接收各字段，这里不做类型转换
+                    **{field.key: field.raw(self.current_data) for field in TELEMETRY_FIELDS if field.upload},
+                    "derivedMetrics": self.derived_values,
                 }
                 print("aaaaaaaaaaaaaa", type(self.current_data[3]))
 
@@ -491,6 +1443,7 @@ class SerialReader(QMainWindow):
                 print("后p端数据请求失败:", e)
                 print("后端数据请求失败:", e)
                 self.token = ""  # 重置令牌
+                self.save_session_state()
                 self.start_get_token()  # 重新启动定时器获取令牌
         if not self.token:
             print("令牌未获取或已失效")
@@ -499,34 +1452,21 @@ class SerialReader(QMainWindow):
         workbook = xlwt.Workbook()
         sheet = workbook.add_sheet('Serial Data')
 
-        # 写入表头
-        headers = ['Time', 'Latitude', 'Longitude', 'Altitude', 'Ground Speed', 'Climb Speed', 'Accelerated Speed',
-                   'Fusion Altitude', 'Pressure Altitude', 'GPS Altitude', 'Target Altitude', 'PT100 Temperature',
-                   'PCB Temperature', 'Battery Voltage', 'Capacitor Voltage', 'Venting Time', 'Ballast Dropping',
-                   'message']
+        # 写入表头，列顺序由 EXPORT_COLUMNS 决定，列名带单位
+        export_fields = [TELEMETRY_BY_KEY[key] for _, key in EXPORT_COLUMNS]
+        headers = ([field.header(name) for (name, _), field in zip(EXPORT_COLUMNS, export_fields)]
+                   + [f'{name}({unit})' for _, name, unit, _, _ in DERIVED_METRICS])
         for col, header in enumerate(headers):
             sheet.write(0, col, header)
 
         # 写入数据
-        for row in range(len(self.times)):
-            sheet.write(row + 1, 0, self.current_data[2])  # 时间
-            sheet.write(row + 1, 1, self.current_data[8])  # 纬度
-            sheet.write(row + 1, 2, self.current_data[7])  # 经度
-            sheet.write(row + 1, 3, self.altitudes[row])  # 高度
-            sheet.write(row + 1, 4, self.current_data[4])  # 地面速度
-            sheet.write(row + 1, 5, self.current_data[5])  # 上升速度
-            sheet.write(row + 1, 6, self.current_data[6])  # 加速度
-            sheet.write(row + 1, 7, self.current_data[9])  # 融合高度
-            sheet.write(row + 1, 8, self.current_data[10])  # 气压高度
-            sheet.write(row + 1, 9, self.current_data[11])  # GPS高度
-            sheet.write(row + 1, 10, self.current_data[13])  # 目标高度
-            sheet.write(row + 1, 11, self.current_data[14])  # PT100温度
-            sheet.write(row + 1, 12, self.current_data[15])  # PCB温度
-            sheet.write(row + 1, 13, self.current_data[16])  # 电池电压
-            sheet.write(row + 1, 14, self.current_data[17])  # 电容电压
-            sheet.write(row + 1, 15, self.current_data[18])  # 排气时间
-            sheet.write(row + 1, 16, self.current_data[19])  # 抛物量
-            sheet.write(row + 1, 17, self.current_data[20])
+        for row, data in enumerate(self.records):
+            for col, field in enumerate(export_fields):
+                sheet.write(row + 1, col, field.value(data))  # 数值按数值写入，便于直接计算和作图
+            # 衍生指标
+            for col, (key, _, _, _, _) in enumerate(DERIVED_METRICS, start=len(export_fields)):
+                value = self.metrics_history[row][key]
+                sheet.write(row + 1, col, '' if value is None else value)
 
         # 生成包含时间戳的文件名
         timestamp = time.strftime("%Y%m%d-%H%M%S")
@@ -534,16 +1474,168 @@ class SerialReader(QMainWindow):
         workbook.save(filename)
         print(f"数据已保存为 Excel 文件: {filename}")
 
+    def session_state(self):
+        if self.uplink:
+            commands = [[c['payload'], c['priority']] for c in self.uplink.snapshot()[0]]
+            uplink_seq = self.uplink.seq
+        else:
+            commands = self.restored_commands
+            uplink_seq = self.restored_uplink_seq
+        return {
+            'port': self.port_box.currentText(),
+            'baudrate': self.baudrate_box.currentText(),
+            'token_url': self.token_url_edit.toPlainText().strip(),
+            'real_time_url': self.real_time_url_edit.toPlainText().strip(),
+            'token': self.token,
+            'data_updated': self.data_updated,
+            'uplink_seq': uplink_seq,
+            'commands': commands,
+        }
+
+    def save_session_state(self):
+        if not self.restoring:
+            self.journal.record_state(self.session_state())
+
+    def apply_session_state(self, state):
+        if state['port']:
+            self.port_box.setCurrentText(state['port'])
+        self.baudrate_box.setCurrentText(state['baudrate'])
+        self.token_url_edit.setPlainText(state['token_url'])
+        self.real_time_url_edit.setPlainText(state['real_time_url'])
+        self.token_url = state['token_url']
+        self.real_time_url = state['real_time_url']
+        self.token = state['token']
+        self.data_updated = state['data_updated']
+        self.restored_uplink_seq = state['uplink_seq']
+        self.restored_commands = state['commands']
+
+    def write_checkpoint(self):
+        # 只追加上次检查点之后的样本：原始数据行、飞行时间和衍生指标，其余数组恢复时由数据行重建
+        keys = [key for key, _, _, _, _ in DERIVED_METRICS]
+        start = self.checkpointed_count
+        samples = [[','.join(data), flight_time, [values[key] for key in keys]]
+                   for data, flight_time, values in zip(self.records[start:], self.altitude_series.x[start:],
+                                                        self.metrics_history[start:])]
+        self.journal.checkpoint({'state': self.session_state(), 'sample_count': len(self.records)}, samples)
+        self.checkpointed_count = len(self.records)
+
+    def checkpoint_if_changed(self):
+        # 没有新数据时不写检查点，空闲时不改动会话文件，启动时才能据修改时间判断会话是否过期
+        if len(self.records) > self.checkpointed_count:
+            self.write_checkpoint()
+
+    def load_samples(self, samples):
+        # 由检查点样本重建轨迹、曲线、导出记录和衍生指标
+        keys = [key for key, _, _, _, _ in DERIVED_METRICS]
+        flight_times = []
+        for line, flight_time, values in samples:
+            data = line.split(',')
+            lat, lon = float(data[8]), float(data[7])
+            if lat != 0 and lon != 0:
+                self.latitudes.append(lat)
+                self.longitudes.append(lon)
+            self.altitudes.append(float(data[10]))
+            self.discharge_volume.append(float(data[18]))
+            self.gas_volume.append(float(data[19]))
+            self.times.append(clock_seconds(data[2]))
+            self.records.append(data)
+            self.metrics_history.append(dict(zip(keys, values)))
+            flight_times.append(flight_time)
+        self.altitude_series.extend(flight_times, self.altitudes)
+        self.gas_volume_series.extend(flight_times, self.gas_volume)
+        self.discharge_volume_series.extend(flight_times, self.discharge_volume)
+        self.checkpointed_count = len(self.records)
+        if not self.records:
+            return
+        self.current_data = self.records[-1]
+        # 用最近的样本重建衍生指标的窗口和平滑状态，时钟从这些样本之前的状态开始
+        start = max(len(self.records) - 2000, 0)
+        if start > 0:
+            self.metrics_engine.last_time = flight_times[start - 1]
+            self.metrics_engine.day_offset = flight_times[start - 1] - self.times[start - 1]
+        for index in range(start, len(self.records)):
+            self.metrics_engine.update(self.records[index], self.times[index])
+        self.derived_values = dict(self.metrics_engine.values)
+
+    def restore_session(self):
+        started = time.perf_counter()
+        checkpoint, samples, entries = self.journal.load()
+        if checkpoint is None and not entries:
+            return
+        # 会话已经很久没有写入，多半是上一次飞行留下的，由操作员决定是否恢复
+        age = time.time() - self.journal.last_modified
+        if age > SESSION_STALE_SECONDS:
+            answer = QMessageBox.question(
+                self, '恢复会话', f'发现 {age / 3600:.1f} 小时前未结束的会话，是否恢复？\n选择“否”将新建会话。',
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            if answer != QMessageBox.Yes:
+                self.journal.reset()
+                print("已放弃上次会话，新建会话")
+                return
+        self.restoring = True
+        if checkpoint is not None:
+            self.apply_session_state(checkpoint['state'])
+            self.load_samples(samples)
+        # 重放检查点之后的日志
+        replayed = 0
+        for entry in entries:
+            if entry['type'] == 'state':
+                self.apply_session_state(entry['state'])
+            elif entry['type'] == 'line':
+                fields = decode_mxx(entry['line'])
+                if fields is not None:
+                    self.process_line(SharedRingBuffer.KIND_MXX, entry['line'], fields)
+                    replayed += 1
+        self.restoring = False
+        # 立即写检查点，下次启动不必再重放同一段日志
+        self.write_checkpoint()
+
+        # 恢复完成后才启动定时器
+        if self.token:
+            self.data_send_timer.start(1000)
+        if self.current_data:
+            self.update_all(self.current_data)
+            self.update_metrics(self.derived_values)
+        print(f"已恢复上次会话: {len(self.times)} 条数据（日志重放 {replayed} 条），"
+              f"{len(self.restored_commands)} 条未完成指令，用时 {time.perf_counter() - started:.2f} 秒")
+
+    def new_session(self):
+        if self.is_reading:
+            print("请先停止读取再新建会话")
+            return
+        self.clear_session()
+        print("已新建会话")
+
+    def clear_session(self):
+        self.journal.reset()
+        self.reset_flight_data()
+        self.data_updated = False
+        self.restored_commands = []
+        for line, _ in self.plot_series:
+            line.set_data([], [])
+        self.canvas.draw_idle()
+        self.init_map()
+        self.telemetry_model.reset()
+        self.update_metrics(self.derived_values)
+        self.data_text_edit.clear()
+
     def customCloseEvent(self, event):
+        if self.is_reading:
+            self.shutdown_ingest()  # 先取走采集进程的剩余数据，保存和检查点才完整
         # 在关闭窗口前保存数据
         self.save_to_excel()
         # 调用父类的closeEvent处理其他关闭逻辑
         self.token_timer.stop()
         self.data_send_timer.stop()
+        if self.broadcaster:
+            self.broadcaster.stop()
+        self.write_checkpoint()
+        self.journal.close()
         super().closeEvent(event)
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # 打包为 exe 后启动采集进程需要
     app = QApplication(sys.argv)
     reader = SerialReader()
     reader.show()